@@ -0,0 +1,217 @@
+import sys
+import json
+import time
+import types
+import threading
+import http.client
+import multiprocessing.pool
+
+# This script checks the prediction server against localhost without needing the real model, tensorflow,
+# sklearn or pandas. We put a stand-in calculator module in place before the server is imported so the
+# server picks it up instead of the real calculator page
+sys.modules['calculator'] = types.ModuleType('calculator')
+import prediction_server
+
+feature_order = ['war', 'allstar_apps']
+
+# Setting this makes the fake model take longer, which is how we fill up the queue on purpose
+model_delay = {'seconds': 0.02}
+
+class FakeScaler:
+    # Like sklearn's StandardScaler, this refuses to scale anything that isn't a real number
+    def transform(self, rows):
+        for row in rows:
+            if any(value != value or value in (float('inf'), float('-inf')) for value in row):
+                raise ValueError("Input contains NaN or infinity")
+
+        return rows
+
+class FakePredictions(list):
+    def reshape(self, shape):
+        return self
+
+class FakeModel:
+    # Predicts a player's chance of election as their WAR divided by 100
+    def predict_on_batch(self, rows):
+        time.sleep(model_delay['seconds'])
+        return FakePredictions(min(1.0, row[0]/100) for row in rows)
+
+calculator = sys.modules['calculator']
+calculator.model_path = "fake_model"
+calculator.pandas = types.SimpleNamespace(DataFrame=lambda rows, columns: rows)
+calculator.keras = types.SimpleNamespace(models=types.SimpleNamespace(load_model=lambda path: FakeModel()))
+
+class CrashingPool:
+    # Acts like a worker process died on any batch containing a player with -1 WAR: the task just
+    # disappears and neither callback is ever called
+    def __init__(self, pool):
+        self.pool = pool
+
+    def apply_async(self, function, args, callback, error_callback):
+        if any(row[0] == -1 for row in args[0]):
+            return None
+
+        return self.pool.apply_async(function, args, callback=callback, error_callback=error_callback)
+
+def start_server(pool, num_workers, queue_size, request_timeout, batch_timeout=30):
+    server = prediction_server.PredictionServer(("127.0.0.1", 0), prediction_server.PredictionRequestHandler)
+    server.feature_order = feature_order
+    server.request_timeout = request_timeout
+    server.service = prediction_server.PredictionService(pool, num_workers, 64, 0.005, queue_size, batch_timeout)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    return server
+
+def send_request(server, method, path, body=None, content_length=None):
+    # Returns the status code and the decoded JSON response. We build the request by hand so we can
+    # send a Content-Length that doesn't match the body
+    connection = http.client.HTTPConnection("127.0.0.1", server.server_address[1], timeout=30)
+    connection.putrequest(method, path)
+    if body is not None:
+        connection.putheader("Content-Length", str(len(body) if content_length is None else content_length))
+    connection.endheaders()
+    if body is not None:
+        connection.send(body)
+
+    response = connection.getresponse()
+    status, response_body = response.status, json.loads(response.read())
+    connection.close()
+
+    return status, response_body
+
+def predict(server, war):
+    return send_request(server, "POST", "/predict", json.dumps({'war': war, 'allstar_apps': 1}).encode('utf-8'))
+
+def send_concurrently(server, war_values):
+    # Send every request at the same time and return the status codes in the same order
+    statuses = [None]*len(war_values)
+
+    def send(index):
+        statuses[index] = predict(server, war_values[index])[0]
+
+    threads = [threading.Thread(target=send, args=[index]) for index in range(len(war_values))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    return statuses
+
+def check_batching(pool):
+    server = start_server(pool, 2, 1024, 5)
+
+    statuses = send_concurrently(server, [index % 100 for index in range(300)])
+    assert statuses == [200]*300, statuses
+
+    status, body = predict(server, 68.3)
+    assert status == 200 and abs(body['hof_probability'] - 0.683) < 1e-9 and body['should_be_elected'], body
+
+    metrics = send_request(server, "GET", "/metrics")[1]
+    assert metrics['requests_completed'] == 301, metrics
+    assert metrics['largest_batch_size'] > 1, metrics
+    print(f"Batching: 300 concurrent requests scored in {metrics['batches_completed']} batches "
+          f"(largest {metrics['largest_batch_size']})")
+
+    server.shutdown()
+
+def check_invalid_requests(pool):
+    server = start_server(pool, 2, 1024, 5)
+
+    bad_bodies = [b'{"war": NaN, "allstar_apps": 1}', b'{"war": Infinity, "allstar_apps": 1}',
+                  b'{"war": 1e400, "allstar_apps": 1}', b'{"war": true, "allstar_apps": 1}',
+                  b'{"war": 1' + b'0'*400 + b', "allstar_apps": 1}',
+                  b'{"war": 1}', b'[1, 2]', b'not json']
+    for body in bad_bodies:
+        status, response = send_request(server, "POST", "/predict", body)
+        assert status == 400, (body, status, response)
+
+    # A negative length used to make the server wait until the client hung up
+    start_time = time.perf_counter()
+    assert send_request(server, "POST", "/predict", b'{}', content_length=-1)[0] == 400
+    assert send_request(server, "POST", "/predict", b'{}', content_length=10**9)[0] == 413
+    assert time.perf_counter() - start_time < 1
+
+    print("Invalid requests: all rejected with 400, or 413 if too large")
+    server.shutdown()
+
+def check_bad_row_isolation(pool):
+    # A row the scaler refuses should only fail itself, not the players batched with it
+    predictions = pool.apply(prediction_server.predict_batch, ([[50, 1], [float('nan'), 1], [20, 1]],))
+    assert predictions == [0.5, None, 0.2], predictions
+
+    print("Bad row isolation: only the bad row failed")
+
+def check_backpressure(pool):
+    model_delay['seconds'] = 0.3
+    server = start_server(pool, 1, 5, 10)
+
+    statuses = send_concurrently(server, [50]*100)
+    assert set(statuses) == {200, 503}, statuses
+
+    metrics = send_request(server, "GET", "/metrics")[1]
+    assert metrics['requests_rejected'] == statuses.count(503), metrics
+    print(f"Backpressure: {statuses.count(503)} of 100 requests turned away with 503")
+
+    model_delay['seconds'] = 0.02
+    server.shutdown()
+
+def check_slow_batches(pool):
+    # A batch that's only slow keeps its worker slot after its request times out, until the worker
+    # actually finishes it, so slow batches can't pile up in the pool. With one worker there are two
+    # slots, so the third request has to wait in the queue and times out there
+    model_delay['seconds'] = 0.6
+    server = start_server(pool, 1, 1024, 0.1, 5)
+
+    for attempt in range(3):
+        assert predict(server, 50)[0] == 504
+    assert len(server.service.in_flight) == 2
+
+    # Once a slot frees up the third request should be dropped instead of being sent to a worker
+    time.sleep(1.5)
+    assert len(server.service.in_flight) == 0
+
+    metrics = send_request(server, "GET", "/metrics")[1]
+    assert metrics['requests_timed_out'] == 3 and metrics['batches_completed'] == 2, metrics
+    print("Slow batches: worker slots held until the workers finished, timed out request never scored")
+
+    model_delay['seconds'] = 0.02
+    server.shutdown()
+
+def check_lost_batches(pool):
+    # With one worker there are only two batch slots, so without the reaper the third lost batch
+    # would wait forever for a slot
+    server = start_server(CrashingPool(pool), 1, 1024, 0.5, 1)
+
+    for attempt in range(3):
+        assert predict(server, -1)[0] == 504
+
+    assert predict(server, 50)[0] == 200
+
+    # The last lost batch may not have been reaped yet, so we give the reaper a moment to catch up
+    deadline = time.perf_counter() + 3
+    metrics = send_request(server, "GET", "/metrics")[1]
+    while metrics['requests_timed_out'] < 3 and time.perf_counter() < deadline:
+        time.sleep(0.1)
+        metrics = send_request(server, "GET", "/metrics")[1]
+
+    assert metrics['requests_timed_out'] == 3 and metrics['requests_completed'] == 1, metrics
+    print("Lost batches: worker slots recovered and timeouts counted separately")
+
+    server.shutdown()
+
+def main():
+    # Threads stand in for the worker processes, but they're set up with the same initializer
+    pool = multiprocessing.pool.ThreadPool(2, initializer=prediction_server.init_worker, initargs=(FakeScaler(), feature_order))
+
+    check_batching(pool)
+    check_invalid_requests(pool)
+    check_bad_row_isolation(pool)
+    check_backpressure(pool)
+    check_slow_batches(pool)
+    check_lost_batches(pool)
+
+    pool.terminate()
+    print("All prediction server checks passed")
+
+if __name__ == "__main__":
+    main()
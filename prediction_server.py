@@ -0,0 +1,496 @@
+import os
+import sys
+import time
+import json
+import math
+import queue
+import argparse
+import threading
+import traceback
+import collections
+import multiprocessing
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# The calculator page lives in the pages folder because that's where streamlit looks for extra pages.
+# We reuse its data loading and model functions so the server always scores players with the exact
+# same model, scaler and feature order as the calculator page
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "pages"))
+import calculator
+
+# These are the default settings for the server. All of them can be changed from the command line
+default_host = "127.0.0.1"
+default_port = 8502
+default_workers = 2
+default_max_batch_size = 64
+default_batch_window = 0.005
+default_queue_size = 1024
+default_request_timeout = 10.0
+default_batch_timeout = 60.0
+
+# A single player's stats take up a few hundred bytes, so anything bigger than this is turned away
+# before we try to read it
+max_request_size = 16384
+
+# This is how many recent request latencies we keep around to calculate the latency percentiles
+latency_history_size = 10000
+
+# Each worker process gets its own copy of these when it starts. They are only ever read, never
+# written, so every worker scores players with an identical model
+worker_model = None
+worker_scaler = None
+worker_features = None
+
+def prepare_model():
+    # We use the same tensorflow seed as the calculator page so that if the model needs to be
+    # regenerated it will be the same model the calculator page would have generated
+    calculator.tensorflow.random.set_seed(128)
+
+    # Load and prepare the training data the same way the calculator page does. The data scaler
+    # is fit on the training split, so this gives us the exact same scaler
+    training_x, training_y = calculator.load_data()
+    train_data, train_labels, test_data, test_labels, data_scaler = calculator.prepare_data(training_x, training_y)
+
+    # If the model doesn't exist yet we train and save it here, in a single process, so the worker
+    # processes can all load the same saved model instead of racing to train their own
+    if not os.path.exists(calculator.model_path):
+        model = calculator.create_model()
+        model = calculator.train_model(model, train_data, train_labels)
+        model.save(calculator.model_path)
+
+    # The feature order is the column order of the training data, which is also the order the
+    # calculator page builds its input dictionary in
+    return data_scaler, list(training_x.columns)
+
+def init_worker(data_scaler, feature_order):
+    # This runs once inside each worker process when the process pool starts up
+    global worker_model, worker_scaler, worker_features
+
+    worker_model = calculator.keras.models.load_model(calculator.model_path)
+    worker_scaler = data_scaler
+    worker_features = feature_order
+
+def score_rows(stat_rows):
+    # We scale the whole batch at once and run it through the model in a single forward pass,
+    # which is much faster than asking the model about each player one at a time
+    batch_stats = calculator.pandas.DataFrame(stat_rows, columns=worker_features)
+    batch_stats_scaled = worker_scaler.transform(batch_stats)
+    predictions = worker_model.predict_on_batch(batch_stats_scaled)
+
+    return [float(prediction) for prediction in predictions.reshape(-1)]
+
+def predict_batch(stat_rows):
+    # stat_rows is a list of lists, each one holding a single player's stats in feature order.
+    # Returns a list with one prediction per row, or None for any row that couldn't be scored
+    try:
+        predictions = score_rows(stat_rows)
+
+    # If the batch fails as a whole we score each row on its own, so one bad player can't cause
+    # a failure for every other player that happened to be batched with it
+    except Exception:
+        predictions = []
+        for stat_row in stat_rows:
+            try:
+                predictions.extend(score_rows([stat_row]))
+            except Exception:
+                predictions.append(None)
+
+    # A prediction that isn't a real number would also produce invalid JSON, so we treat it as a failure
+    return [prediction if prediction is not None and math.isfinite(prediction) else None for prediction in predictions]
+
+class PendingPrediction:
+    # A single player's prediction request. The request handler thread waits on the event until the
+    # batch this request was placed in has been scored
+    def __init__(self, stat_row):
+        self.stat_row = stat_row
+        self.received_time = time.perf_counter()
+        self.finished = threading.Event()
+        self.probability = None
+        self.batch_size = None
+        self.error = None
+        self.timed_out = False
+
+        # The lock makes sure a request can't both time out and be finished by its batch
+        self.lock = threading.Lock()
+
+    def finish(self, probability, batch_size, error):
+        with self.lock:
+            self.probability = probability
+            self.batch_size = batch_size
+            self.error = error
+            self.finished.set()
+
+    def give_up(self):
+        # Called by the request handler when it's done waiting. Returns False if the prediction
+        # arrived at the last moment, in which case the handler can still use it
+        with self.lock:
+            if not self.finished.is_set():
+                self.timed_out = True
+
+            return self.timed_out
+
+class ServerMetrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.start_time = time.time()
+        self.requests_completed = 0
+        self.requests_failed = 0
+        self.requests_rejected = 0
+        self.requests_timed_out = 0
+        self.batches_completed = 0
+        self.batched_requests = 0
+        self.largest_batch = 0
+        self.latencies = collections.deque(maxlen=latency_history_size)
+
+    def record_batch(self, batch):
+        finish_time = time.perf_counter()
+        with self.lock:
+            self.batches_completed += 1
+            self.batched_requests += len(batch)
+            self.largest_batch = max(self.largest_batch, len(batch))
+
+            # Requests that already got a timeout response don't count as completed, and their
+            # latency would only make the percentiles look better than what clients actually saw
+            for pending in batch:
+                if pending.timed_out:
+                    self.requests_timed_out += 1
+                elif pending.error is None:
+                    self.requests_completed += 1
+                    self.latencies.append(finish_time - pending.received_time)
+                else:
+                    self.requests_failed += 1
+
+    def record_timeouts(self, count):
+        with self.lock:
+            self.requests_timed_out += count
+
+    def record_rejection(self):
+        with self.lock:
+            self.requests_rejected += 1
+
+    def summary(self, queue_depth):
+        with self.lock:
+            uptime = time.time() - self.start_time
+            latencies = sorted(self.latencies)
+
+            # This lambda function finds the given percentile of the recent latencies in milliseconds
+            # Ex: percentile(0.95) -> the latency that 95% of recent requests finished under
+            percentile = lambda p: round(latencies[min(len(latencies) - 1, int(p*len(latencies)))]*1000, 3) if latencies else None
+
+            return {
+                "uptime_seconds": round(uptime, 3),
+                "requests_completed": self.requests_completed,
+                "requests_failed": self.requests_failed,
+                "requests_rejected": self.requests_rejected,
+                "requests_timed_out": self.requests_timed_out,
+                "batches_completed": self.batches_completed,
+                "average_batch_size": round(self.batched_requests/self.batches_completed, 3) if self.batches_completed else None,
+                "largest_batch_size": self.largest_batch,
+                "queue_depth": queue_depth,
+                "throughput_per_second": round(self.requests_completed/uptime, 3) if uptime > 0 else None,
+                "latency_ms": {
+                    "p50": percentile(0.50),
+                    "p95": percentile(0.95),
+                    "p99": percentile(0.99),
+                    "max": round(latencies[-1]*1000, 3) if latencies else None
+                }
+            }
+
+class PredictionService:
+    def __init__(self, pool, num_workers, max_batch_size, batch_window, queue_size, batch_timeout):
+        self.pool = pool
+        self.max_batch_size = max_batch_size
+        self.batch_window = batch_window
+        self.batch_timeout = batch_timeout
+        self.metrics = ServerMetrics()
+
+        # Requests wait in this queue until the batcher picks them up. The queue has a maximum size, so
+        # if the workers fall behind new requests are turned away instead of piling up forever
+        self.request_queue = queue.Queue(maxsize=queue_size)
+
+        # We only let each worker have two batches at a time: one being scored and one waiting. Once
+        # every worker is busy the batcher stops taking requests off the queue, the queue fills up,
+        # and that's what causes new requests to be turned away
+        self.worker_slots = threading.BoundedSemaphore(num_workers*2)
+
+        # Every batch that has been sent to a worker but not finished yet, along with the time we give up
+        # on it. Whichever of the pool callbacks or the reaper finishes a batch first removes it from here.
+        # The batch timeout has to be much longer than the request timeout: the reaper can't tell a lost
+        # batch from a slow one, and every slow batch it reaps lets another batch pile up in the pool
+        self.in_flight = {}
+        self.in_flight_lock = threading.Lock()
+        self.next_batch_id = 0
+
+        self.batcher_thread = threading.Thread(target=self.run_batcher, daemon=True)
+        self.batcher_thread.start()
+        self.reaper_thread = threading.Thread(target=self.run_reaper, daemon=True)
+        self.reaper_thread.start()
+
+    def submit(self, stat_row):
+        # Returns None if the queue is full so the request handler can tell the client to back off
+        pending = PendingPrediction(stat_row)
+        try:
+            self.request_queue.put_nowait(pending)
+        except queue.Full:
+            self.metrics.record_rejection()
+            return None
+
+        return pending
+
+    def collect_batch(self):
+        # Wait for the first request, then keep collecting requests until the batch window runs out
+        # or the batch is full, whichever happens first
+        batch = [self.request_queue.get()]
+        deadline = time.perf_counter() + self.batch_window
+
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+
+            try:
+                batch.append(self.request_queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+
+        # Requests that timed out while they were waiting in the queue have already been sent a timeout
+        # response, so scoring them would only waste worker time that other requests are waiting on
+        live_batch = [pending for pending in batch if not pending.timed_out]
+        if len(live_batch) < len(batch):
+            self.metrics.record_timeouts(len(batch) - len(live_batch))
+
+        return live_batch
+
+    def run_batcher(self):
+        while True:
+            self.worker_slots.acquire()
+            batch = self.collect_batch()
+
+            # If every request in the batch had already timed out there's nothing to send to the workers
+            if not batch:
+                self.worker_slots.release()
+                continue
+
+            with self.in_flight_lock:
+                batch_id = self.next_batch_id
+                self.next_batch_id += 1
+                self.in_flight[batch_id] = (batch, time.perf_counter() + self.batch_timeout)
+
+            # The callbacks run on the pool's result thread once a worker has finished scoring the batch
+            self.pool.apply_async(predict_batch, ([pending.stat_row for pending in batch],),
+                                  callback=lambda results, batch_id=batch_id: self.finish_batch(batch_id, results, None),
+                                  error_callback=lambda error, batch_id=batch_id: self.finish_batch(batch_id, None, error))
+
+    def run_reaper(self):
+        # If a worker process dies while scoring a batch, the pool quietly replaces it and neither callback
+        # is ever called. Without this the batch would keep its worker slot forever, and once every slot
+        # was lost this way the server would turn away every request until it was restarted. We give up on
+        # a batch once it has gone well past the time any model should need to score it, rather than
+        # trying to find out which worker died, since the pool doesn't tell us which task a worker was on
+        while True:
+            time.sleep(min(1.0, self.batch_timeout/4))
+
+            with self.in_flight_lock:
+                now = time.perf_counter()
+                expired_batches = [batch_id for batch_id, (batch, deadline) in self.in_flight.items() if deadline <= now]
+
+            for batch_id in expired_batches:
+                self.finish_batch(batch_id, None, "The worker scoring this batch did not respond")
+
+    def finish_batch(self, batch_id, results, error):
+        # The batch may already have been finished by the reaper, in which case there's nothing left to do
+        with self.in_flight_lock:
+            if batch_id not in self.in_flight:
+                return
+
+            batch = self.in_flight.pop(batch_id)[0]
+
+        # Hand each request its result and wake up the request handler that was waiting on it
+        for index, pending in enumerate(batch):
+            if error is not None:
+                pending.finish(None, len(batch), error)
+            elif results[index] is None:
+                pending.finish(None, len(batch), "This player's stats could not be scored")
+            else:
+                pending.finish(results[index], len(batch), None)
+
+        self.metrics.record_batch(batch)
+        self.worker_slots.release()
+
+class PredictionRequestHandler(BaseHTTPRequestHandler):
+    def send_json(self, status, body, headers=None):
+        encoded_body = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(encoded_body)))
+        for header, value in (headers or {}).items():
+            self.send_header(header, value)
+        self.end_headers()
+        self.wfile.write(encoded_body)
+
+    def read_stat_row(self):
+        # Read the player's stats from the request body and put them in the same order as the training
+        # data. Returns the row, or the error status code and message if the request can't be scored
+        try:
+            content_length = int(self.headers.get("Content-Length", 0))
+        except ValueError:
+            return None, 400, "Content-Length must be a whole number"
+
+        # A negative length would make us read until the client hangs up, and a huge one would make us
+        # wait on and hold that many bytes
+        if content_length < 0:
+            return None, 400, "Content-Length must not be negative"
+        if content_length > max_request_size:
+            return None, 413, f"Request body must be at most {max_request_size} bytes"
+
+        try:
+            player_stats = json.loads(self.rfile.read(content_length))
+        except (ValueError, UnicodeDecodeError):
+            return None, 400, "Request body must be a JSON object"
+
+        if not isinstance(player_stats, dict):
+            return None, 400, "Request body must be a JSON object"
+
+        missing_stats = [stat for stat in self.server.feature_order if stat not in player_stats]
+        if missing_stats:
+            return None, 400, f"Missing stats: {', '.join(missing_stats)}"
+
+        # bool is a subclass of int in python, so we have to rule it out separately
+        invalid_stats = [stat for stat in self.server.feature_order
+                         if isinstance(player_stats[stat], bool) or not isinstance(player_stats[stat], (int, float))]
+        if invalid_stats:
+            return None, 400, f"Stats must be numbers: {', '.join(invalid_stats)}"
+
+        # The JSON parser accepts NaN and Infinity, turns float literals too big for a float into infinity,
+        # and keeps integers of any size, which can't be converted to a float at all. The model can only
+        # score real numbers, so we convert every stat to a float here and reject anything that doesn't fit
+        stat_row = []
+        non_finite_stats = []
+        for stat in self.server.feature_order:
+            try:
+                value = float(player_stats[stat])
+            except OverflowError:
+                value = math.inf
+
+            if not math.isfinite(value):
+                non_finite_stats.append(stat)
+            stat_row.append(value)
+
+        if non_finite_stats:
+            return None, 400, f"Stats must be finite numbers: {', '.join(non_finite_stats)}"
+
+        return stat_row, None, None
+
+    def do_GET(self):
+        if self.path == "/health":
+            self.send_json(200, {"status": "ok", "features": self.server.feature_order})
+
+        elif self.path == "/metrics":
+            service = self.server.service
+            self.send_json(200, service.metrics.summary(service.request_queue.qsize()))
+
+        else:
+            self.send_json(404, {"error": f"Unknown path '{self.path}'"})
+
+    def do_POST(self):
+        if self.path != "/predict":
+            self.send_json(404, {"error": f"Unknown path '{self.path}'"})
+            return
+
+        stat_row, error_status, error_message = self.read_stat_row()
+        if error_message is not None:
+            self.send_json(error_status, {"error": error_message})
+            return
+
+        pending = self.server.service.submit(stat_row)
+        if pending is None:
+            self.send_json(503, {"error": "Server is busy, try again shortly"}, headers={"Retry-After": "1"})
+            return
+
+        if not pending.finished.wait(self.server.request_timeout) and pending.give_up():
+            self.send_json(504, {"error": "Timed out waiting for a prediction"})
+            return
+
+        if pending.error is not None:
+            self.send_json(500, {"error": f"Prediction failed: {pending.error}"})
+            return
+
+        # Just like the calculator page, anything under a 50% chance is a recommendation against election
+        self.send_json(200, {
+            "hof_probability": pending.probability,
+            "should_be_elected": pending.probability >= 0.5,
+            "batch_size": pending.batch_size
+        })
+
+    def log_message(self, format, *args):
+        # The default handler prints a line for every request, which would flood the console under load
+        pass
+
+class PredictionServer(ThreadingHTTPServer):
+    # Lots of clients connecting at once is exactly what this server is for, so we let more
+    # connections wait to be accepted than the default of 5
+    request_queue_size = 128
+    daemon_threads = True
+
+def get_arguments():
+    parser = argparse.ArgumentParser(description="Serve Hall of Fame predictions over HTTP/JSON")
+    parser.add_argument("--host", default=default_host)
+    parser.add_argument("--port", type=int, default=default_port)
+    parser.add_argument("--workers", type=int, default=default_workers, help="Number of model worker processes")
+    parser.add_argument("--max-batch-size", type=int, default=default_max_batch_size, help="Most players scored in one forward pass")
+    parser.add_argument("--batch-window", type=float, default=default_batch_window, help="Seconds to wait for more requests to join a batch")
+    parser.add_argument("--queue-size", type=int, default=default_queue_size, help="Most requests allowed to wait before new ones are rejected")
+    parser.add_argument("--request-timeout", type=float, default=default_request_timeout, help="Seconds a request waits for its prediction")
+    parser.add_argument("--batch-timeout", type=float, default=default_batch_timeout,
+                        help="Seconds before a batch is assumed lost to a crashed worker, must be longer than the request timeout")
+
+    arguments = parser.parse_args()
+    if arguments.batch_timeout <= arguments.request_timeout:
+        parser.error("--batch-timeout must be longer than --request-timeout")
+
+    return arguments
+
+def main():
+    arguments = get_arguments()
+
+    print("Preparing AI...")
+    data_scaler, feature_order = prepare_model()
+
+    # We use "spawn" so each worker starts from a fresh process instead of a fork of this one, since
+    # tensorflow doesn't behave well in forked processes
+    context = multiprocessing.get_context("spawn")
+    with context.Pool(arguments.workers, initializer=init_worker, initargs=(data_scaler, feature_order)) as pool:
+        server = PredictionServer((arguments.host, arguments.port), PredictionRequestHandler)
+        server.feature_order = feature_order
+        server.request_timeout = arguments.request_timeout
+        server.service = PredictionService(pool, arguments.workers, arguments.max_batch_size,
+                                           arguments.batch_window, arguments.queue_size, arguments.batch_timeout)
+
+        print(f"Serving predictions on http://{arguments.host}:{arguments.port}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+
+if __name__ == "__main__":
+    try:
+        main()
+
+    # If an error occurs during program execution, we log the error to a file
+    except Exception as ex:
+        log_dir = 'Error Logs'
+        log_path = f"{log_dir}/{time.strftime('%Y-%m-%d_%H-%M-%S')}.txt"
+
+        # Make the error log folder if it doesn't exist already
+        try:
+            os.makedirs(log_dir)
+        except FileExistsError:
+            pass
+
+        # Write the error message to the log file
+        with open(log_path, mode='w') as f:
+            f.write(traceback.format_exc())
+
+        # Raise the exception that was caught
+        raise